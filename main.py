@@ -2,10 +2,296 @@ from turtle import color
 import pygame
 import pygame_gui
 import random
+import gc
+import json
+import statistics
+import time
+from collections import deque
+from contextlib import contextmanager
+import sys
+import numpy as np
 from mesa import Agent as MesaAgent, Model as MesaModel
 from mesa.time import RandomActivation
 from mesa.space import MultiGrid
 from mesa.datacollection import DataCollector
+from shared_state import SharedStateWriter
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    tomllib = None
+
+# Roles an agent can start with, in the order their IDs are assigned
+AGENT_ROLES = ("citizen", "dealer", "police", "data-collector")
+
+# Probabilities used by the agent behaviours
+DEFAULT_BEHAVIOR = {
+    "conversion_chance": 0.3,   # citizen meeting a dealer is tempted
+    "addiction_chance": 0.5,    # tempted citizen becomes a drug user
+    "dealer_seek_chance": 0.3,  # dealer moves towards high drug presence
+    "arrest_chance": 0.4,       # police arrest a nearby suspect
+}
+
+# Interaction radius in cells for each role (Chebyshev distance, 0 = same cell).
+# A data collector radius of None senses drug users anywhere on the grid.
+DEFAULT_RADIUS = {
+    "citizen": 0,         # citizens notice dealers
+    "dealer": 1,          # dealers look for high drug presence and move straight to the best
+                          # cell found, so this is also how far a dealer can jump in one step
+    "police": 0,          # police detect suspects
+    "data-collector": None,  # data collectors sense drug users
+}
+
+# Colour index used for each agent in the fast view; arrested agents share one colour
+DISPLAY_CODES = {"citizen": 0, "dealer": 1, "police": 2, "data-collector": 3, "drug-user": 4}
+ARRESTED_CODE = 5
+DISPLAY_COLOURS = np.array([
+    (70, 130, 180),   # citizen
+    (200, 30, 30),    # dealer
+    (20, 20, 140),    # police
+    (230, 160, 0),    # data collector
+    (150, 60, 170),   # drug user
+    (90, 90, 90),     # arrested
+], dtype=np.uint8)
+BACKGROUND_COLOUR = np.array((240, 240, 240), dtype=np.uint8)
+
+def display_code(agent):
+    return DISPLAY_CODES[agent.role] if agent.status == "active" else ARRESTED_CODE
+
+# When a run is considered finished; None switches a criterion off
+DEFAULT_STOP = {
+    "max_steps": None,           # stop after this many steps
+    "dealers_arrested": True,    # stop once no active dealers remain
+    "stable_steps": None,        # stop when the counters have not changed for this many steps
+    "variance_window": None,     # number of recent steps the variance test looks at
+    "variance_threshold": None,  # stop when every counter's variance over the window is at most this
+}
+
+DEFAULT_SCENARIO = {
+    "width": 40,
+    "height": 35,
+    "seed": None,
+    "agents": {"citizen": 200, "dealer": 10, "police": 10, "data-collector": 5},
+    "placement": {},
+    "behavior": DEFAULT_BEHAVIOR,
+    "radius": DEFAULT_RADIUS,
+    "stop": DEFAULT_STOP,
+    "shared_memory": None,  # segment name to publish agent state under, see shared_state.py
+}
+
+@contextmanager
+def gc_paused():
+    # Garbage collection passes dominate when allocating millions of objects at once.
+    # Everything allocated meanwhile is frozen before collection resumes, otherwise the
+    # first young-generation pass walks all of it. Frozen objects are only collected
+    # again after gc.unfreeze().
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.freeze()
+            gc.enable()
+
+def is_count(value):
+    # Non-negative int; bool is an int subclass but never a valid count
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+def load_scenario(path):
+    # Read a JSON or TOML scenario file and fill in missing values from the defaults
+    if path.endswith(".toml"):
+        if tomllib is None:
+            raise ValueError("TOML scenarios require Python 3.11 or newer")
+        with open(path, "rb") as f:
+            data = tomllib.load(f)
+    else:
+        with open(path, "r") as f:
+            data = json.load(f)
+    return validate_scenario(data)
+
+def validate_scenario(data):
+    # Check a scenario dict and return a copy with missing values filled from the defaults
+    for key in data:
+        if key not in DEFAULT_SCENARIO:
+            raise ValueError(f"Unknown scenario setting: {key}")
+    for key in ("agents", "placement", "behavior", "radius", "stop"):
+        if not isinstance(data.get(key, {}), dict):
+            raise ValueError(f"Scenario {key} must be a table of settings")
+
+    scenario = dict(DEFAULT_SCENARIO)
+    scenario.update(data)
+    scenario["agents"] = {**DEFAULT_SCENARIO["agents"], **data.get("agents", {})}
+    scenario["behavior"] = {**DEFAULT_BEHAVIOR, **data.get("behavior", {})}
+    scenario["radius"] = {**DEFAULT_RADIUS, **data.get("radius", {})}
+    scenario["stop"] = {**DEFAULT_STOP, **data.get("stop", {})}
+
+    for key in ("width", "height"):
+        if not is_count(scenario[key]) or scenario[key] == 0:
+            raise ValueError(f"Scenario {key} must be a positive number of cells")
+    for role, count in scenario["agents"].items():
+        if role not in AGENT_ROLES:
+            raise ValueError(f"Unknown role in scenario: {role}")
+        if not is_count(count):
+            raise ValueError(f"Number of {role} agents must be a non-negative integer")
+    if scenario["seed"] is not None and not is_count(scenario["seed"]):
+        raise ValueError("Scenario seed must be a non-negative integer")
+    if scenario["shared_memory"] is not None and (not isinstance(scenario["shared_memory"], str)
+                                                  or not scenario["shared_memory"]):
+        raise ValueError("Scenario shared_memory must be a segment name")
+    validate_placement(scenario["placement"])
+    validate_behavior(scenario["behavior"])
+    validate_radius(scenario["radius"])
+    validate_stop(scenario["stop"])
+    return scenario
+
+def validate_placement(placement):
+    for role, spec in placement.items():
+        if role not in AGENT_ROLES:
+            raise ValueError(f"Unknown role in placement: {role}")
+        if spec == "random":
+            continue
+        if not isinstance(spec, dict) or len(spec) != 1 or not ("positions" in spec or "density" in spec):
+            raise ValueError(f"Placement for {role} must be \"random\" or a table with positions or density")
+        if not isinstance(next(iter(spec.values())), list):
+            raise ValueError(f"Placement {next(iter(spec))} for {role} must be a list")
+
+def validate_behavior(behavior):
+    for key, value in behavior.items():
+        if key not in DEFAULT_BEHAVIOR:
+            raise ValueError(f"Unknown behavior setting: {key}")
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 <= value <= 1:
+            raise ValueError(f"{key} must be a probability between 0 and 1")
+
+def validate_radius(radius):
+    for role, value in radius.items():
+        if role not in AGENT_ROLES:
+            raise ValueError(f"Unknown role in radius: {role}")
+        if value is None and role == "data-collector":
+            continue
+        if not is_count(value):
+            raise ValueError(f"Radius for {role} must be a non-negative number of cells")
+
+def validate_stop(criteria):
+    for key in criteria:
+        if key not in DEFAULT_STOP:
+            raise ValueError(f"Unknown stop criterion: {key}")
+    criteria = {**DEFAULT_STOP, **criteria}
+    if not isinstance(criteria["dealers_arrested"], bool):
+        raise ValueError("dealers_arrested must be true or false")
+    for key in ("max_steps", "stable_steps"):
+        if criteria[key] is not None and not is_count(criteria[key]):
+            raise ValueError(f"{key} must be a non-negative integer")
+    window = criteria["variance_window"]
+    threshold = criteria["variance_threshold"]
+    if (window is None) != (threshold is None):
+        raise ValueError("variance_window and variance_threshold must be set together")
+    if window is not None and (not is_count(window) or window == 0):
+        raise ValueError("variance_window must be at least 1 step")
+    if threshold is not None and (isinstance(threshold, bool) or not isinstance(threshold, (int, float))
+                                  or threshold < 0):
+        raise ValueError("variance_threshold must be a non-negative number")
+
+class SpatialGrid:
+    # Buckets agents by cell so interaction queries only look at nearby cells
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        # A cell's list is built on first use from the batches still pending in add_agents
+        self.cells = [None] * (width * height)
+        self.pending = []  # (agents, agent order sorted by cell, per-cell start offsets) for each batch
+        self.offset_tables = {}  # radius -> neighbour offsets, see offsets()
+        # Agents of each display code per cell, kept current so drawing never walks the agents
+        self.display_counts = np.zeros((len(DISPLAY_COLOURS), width * height), dtype=np.int32)
+
+    def cell_index(self, pos):
+        return pos[1] * self.width + pos[0]
+
+    def cell_pos(self, index):
+        return (index % self.width, index // self.width)
+
+    def add_agents(self, agents, xs, ys, codes, first=0):
+        # Group a batch by cell with one sort; agents[first + i] is at (xs[i], ys[i]) with codes[i]
+        num_cells = len(self.cells)
+        indices = ys * self.width + xs
+        order = np.argsort(indices)
+        if first:
+            order += first
+        starts = np.zeros(num_cells + 1, dtype=np.int64)
+        np.cumsum(np.bincount(indices, minlength=num_cells), out=starts[1:])
+        batch = (agents, order, starts)
+        # Cells already built would not see the new batch, so add to them directly
+        if self.cells.count(None) != num_cells:
+            for index in np.unique(indices).tolist():
+                if self.cells[index] is not None:
+                    self.extend_cell(self.cells[index], index, batch)
+        self.pending.append(batch)
+        counts = np.bincount(codes * num_cells + indices, minlength=self.display_counts.size)
+        self.display_counts += counts.reshape(self.display_counts.shape).astype(np.int32)
+
+    def extend_cell(self, cell, index, batch):
+        agents, order, starts = batch
+        cell.extend(map(agents.__getitem__, order[starts[index]:starts[index + 1]].tolist()))
+
+    def cell(self, index):
+        cell = self.cells[index]
+        if cell is None:
+            cell = self.cells[index] = []
+            for batch in self.pending:
+                self.extend_cell(cell, index, batch)
+        return cell
+
+    def move(self, agent, new_pos):
+        if new_pos != agent.pos:
+            old_index = self.cell_index(agent.pos)
+            new_index = self.cell_index(new_pos)
+            self.cell(old_index).remove(agent)
+            self.cell(new_index).append(agent)
+            code = display_code(agent)
+            self.display_counts[code, old_index] -= 1
+            self.display_counts[code, new_index] += 1
+            agent.pos = new_pos
+
+    def recode(self, pos, old_code, new_code):
+        # An agent at pos changed role or status
+        index = self.cell_index(pos)
+        self.display_counts[old_code, index] -= 1
+        self.display_counts[new_code, index] += 1
+
+    def dominant_colours(self):
+        # Colour of the most common display code in each cell, shaped (width, height, 3) for surfarray
+        counts = self.display_counts
+        pixels = DISPLAY_COLOURS[counts.argmax(axis=0)]
+        pixels[~counts.any(axis=0)] = BACKGROUND_COLOUR
+        return pixels.reshape(self.height, self.width, 3).transpose(1, 0, 2)
+
+    def offsets(self, radius):
+        # (dx, dy) pairs within radius and their matching flat index offsets, built once per radius
+        table = self.offset_tables.get(radius)
+        if table is None:
+            pairs = tuple((dx, dy) for dx in range(-radius, radius + 1) for dy in range(-radius, radius + 1))
+            table = self.offset_tables[radius] = (pairs, tuple(dy * self.width + dx for dx, dy in pairs))
+        return table
+
+    def neighbourhood(self, pos, radius):
+        # Cell indices within radius of pos; only cells near an edge need clipping
+        pairs, linear = self.offsets(radius)
+        x, y = pos
+        index = y * self.width + x
+        if radius <= x < self.width - radius and radius <= y < self.height - radius:
+            for offset in linear:
+                yield index + offset
+        else:
+            width, height = self.width, self.height
+            for (dx, dy), offset in zip(pairs, linear):
+                if 0 <= x + dx < width and 0 <= y + dy < height:
+                    yield index + offset
+
+    def agents_near(self, pos, radius):
+        cells = self.cells
+        for index in self.neighbourhood(pos, radius):
+            cell = cells[index]
+            yield from cell if cell is not None else self.cell(index)
 
 class Message:
     def __init__(self, sender, receiver, content):
@@ -14,27 +300,31 @@ class Message:
         self.content = content
 
 class Agent:
-    def __init__(self, unique_id, model, role):
+    __slots__ = ("unique_id", "model", "role", "status", "pos", "_messages", "trust_level", "icon")
+
+    def __init__(self, unique_id, model, role, pos=None, trust_level=None):
         self.unique_id = unique_id
         self.model = model
         self.role = role
         self.status = "active"
-        self.pos = (random.randint(0, model.grid_width - 1), random.randint(0, model.grid_height - 1))
-        self.messages = []
+        if pos is None:
+            pos = (random.randint(0, model.grid_width - 1), random.randint(0, model.grid_height - 1))
+        self.pos = pos
         
         # Role-specific attributes
         if role == "citizen":
-            self.trust_level = random.randint(0, 100)
-            self.icon = model.citizen_icon
-        elif role == "dealer":
-            self.icon = model.dealer_icon
-        elif role == "police":
-            self.icon = model.police_icon
-        elif role == "data-collector":
-            self.icon = model.data_collector_icon
-        elif role == "drug-user":
-            self.icon = model.drug_user_icon
+            self.trust_level = random.randint(0, 100) if trust_level is None else trust_level
+        self.icon = model.role_icons[role]
     
+    @property
+    def messages(self):
+        # Most agents never receive a message, so the list is only created when needed
+        try:
+            return self._messages
+        except AttributeError:
+            self._messages = []
+            return self._messages
+
     def move_nearby(self):
         # Move to a nearby grid cell instead of completely random
         x, y = self.pos
@@ -42,7 +332,7 @@ class Agent:
         dy = random.randint(-1, 1)
         new_x = max(0, min(self.model.grid_width - 1, x + dx))
         new_y = max(0, min(self.model.grid_height - 1, y + dy))
-        self.pos = (new_x, new_y)
+        self.model.grid.move(self, (new_x, new_y))
     
     def step(self):
         if self.status == "active":
@@ -59,44 +349,46 @@ class Agent:
     
     def citizen_behavior(self):
         # More nuanced drug user conversion
-        nearby_dealers = sum(1 for agent in self.model.agents 
-                            if agent.role == "dealer" and agent.status == "active" 
-                            and agent.pos == self.pos)
+        radius = self.model.interaction_radius["citizen"]
+        nearby_dealers = sum(1 for agent in self.model.grid.agents_near(self.pos, radius)
+                            if agent.role == "dealer" and agent.status == "active")
         
-        if nearby_dealers > 0 and random.random() < 0.3:
+        behavior = self.model.behavior
+        if nearby_dealers > 0 and random.random() < behavior["conversion_chance"]:
             # Only some citizens become drug users
-            if random.random() < 0.5:  # 50% chance to become a drug user
+            if random.random() < behavior["addiction_chance"]:
                 self.role = "drug-user"
                 self.icon = self.model.drug_user_icon
+                self.model.grid.recode(self.pos, DISPLAY_CODES["citizen"], DISPLAY_CODES["drug-user"])
                 self.model.drug_users += 1
     
     def dealer_behavior(self):
         # Dealers tend to stay in areas with high drug presence
-        if random.random() < 0.3:
+        if random.random() < self.model.behavior["dealer_seek_chance"]:
             # Find a nearby patch with high drug presence
-            possible_moves = [
-                (self.pos[0]+dx, self.pos[1]+dy) 
-                for dx in [-1,0,1] 
-                for dy in [-1,0,1]
-                if 0 <= self.pos[0]+dx < self.model.grid_width and 
-                   0 <= self.pos[1]+dy < self.model.grid_height
-            ]
-            best_move = max(possible_moves, key=lambda p: self.model.drug_presence.get(p, 0))
-            self.pos = best_move
+            grid = self.model.grid
+            drug_presence = self.model.drug_presence
+            best_move, best_presence = -1, -1
+            for index in grid.neighbourhood(self.pos, self.model.interaction_radius["dealer"]):
+                presence = drug_presence.item(index)
+                if presence > best_presence:
+                    best_move, best_presence = index, presence
+            grid.move(self, grid.cell_pos(best_move))
     
     def police_behavior(self):
         # More targeted arrest logic
+        radius = self.model.interaction_radius["police"]
         nearby_agents = [
-            agent for agent in self.model.agents 
+            agent for agent in self.model.grid.agents_near(self.pos, radius)
             if (agent.role == "drug-user" or agent.role == "dealer") 
-            and agent.status == "active" 
-            and agent.pos == self.pos
+            and agent.status == "active"
         ]
         
-        if nearby_agents and random.random() < 0.4:
+        if nearby_agents and random.random() < self.model.behavior["arrest_chance"]:
             target = random.choice(nearby_agents)
             target.status = "inactive"
             target.icon = self.model.arrest_icon  # Change icon to arrest.png
+            self.model.grid.recode(target.pos, DISPLAY_CODES[target.role], ARRESTED_CODE)
             self.model.arrests += 1
             
             if target.role == "dealer":
@@ -106,23 +398,24 @@ class Agent:
     
     def data_collector_behavior(self):
         # More comprehensive data collection
-        nearby_agents = [
-            agent for agent in self.model.agents 
-            if agent.role == "drug-user" and agent.status == "active"
-        ]
+        radius = self.model.interaction_radius["data-collector"]
+        if radius is None:
+            # Every active drug user on the grid is counted
+            nearby_users = self.model.drug_users
+        else:
+            nearby_users = sum(1 for agent in self.model.grid.agents_near(self.pos, radius)
+                               if agent.role == "drug-user" and agent.status == "active")
         
-        if nearby_agents:
-            if self.pos not in self.model.drug_presence:
-                self.model.drug_presence[self.pos] = 0
-            self.model.drug_presence[self.pos] += len(nearby_agents)
+        if nearby_users:
+            x, y = self.pos
+            self.model.drug_presence[y, x] += nearby_users
         
         # Send messages to police and civilians
-        for agent in self.model.agents:
-            if agent.pos == self.pos:
-                if agent.role == "police":
-                    self.send_message(agent, "Drug activity detected")
-                elif agent.role == "citizen":
-                    self.send_message(agent, "Stay safe, drug activity nearby")
+        for agent in self.model.grid.agents_near(self.pos, 0):
+            if agent.role == "police":
+                self.send_message(agent, "Drug activity detected")
+            elif agent.role == "citizen":
+                self.send_message(agent, "Stay safe, drug activity nearby")
 
     def send_message(self, receiver, content):
         message = Message(self.unique_id, receiver.unique_id, content)
@@ -134,13 +427,30 @@ class Agent:
         print(f"Agent {self.unique_id} received message from Agent {message.sender}: {message.content}")
 
 class DrugModel:
-    def __init__(self, width, height, num_citizens, num_dealers, num_police, num_data_collectors):
+    def __init__(self, width, height, num_citizens, num_dealers, num_police, num_data_collectors,
+                 behavior=None, placement=None, seed=None, radius=None, stop=None):
+        validate_behavior(behavior or {})
+        validate_placement(placement or {})
+        validate_radius(radius or {})
+        validate_stop(stop or {})
         self.grid_width = width
         self.grid_height = height
+        self.behavior = {**DEFAULT_BEHAVIOR, **(behavior or {})}
+        self.placement = placement or {}
+        self.interaction_radius = {**DEFAULT_RADIUS, **(radius or {})}
+        self.grid = SpatialGrid(width, height)
+        self.stop_criteria = {**DEFAULT_STOP, **(stop or {})}
+        self.stop_reason = None
+        self.steps_unchanged = 0
+        self.counter_history = deque(maxlen=self.stop_criteria["variance_window"] or 0)
+        self.shared_state = None
+        self.rng = np.random.default_rng(seed)
+        if seed is not None:
+            random.seed(seed)
         self.drug_users = 0
         self.drug_dealers = num_dealers
         self.arrests = 0
-        self.drug_presence = {}
+        self.drug_presence = np.zeros((height, width), dtype=np.int64)  # indexed [y, x]
         self.simulation_time = 0
         self.messages = []  # Store messages
         
@@ -164,33 +474,187 @@ class DrugModel:
         self.data_collector_icon = pygame.transform.scale(self.data_collector_icon, (20, 20))
         self.drug_user_icon = pygame.transform.scale(self.drug_user_icon, (20, 20))
         self.arrest_icon = pygame.transform.scale(self.arrest_icon, (20, 20))  # Scale arrest.png
+
+        self.role_icons = {
+            "citizen": self.citizen_icon,
+            "dealer": self.dealer_icon,
+            "police": self.police_icon,
+            "data-collector": self.data_collector_icon,
+            "drug-user": self.drug_user_icon,
+        }
         
-        # Create agents with unified agent creation
+        # Create agents in bulk, one batch per role
         self.agents = []
-        
-        # Create citizens
-        for i in range(num_citizens):
-            self.agents.append(Agent(i, self, "citizen"))
-        
-        # Create dealers
-        for i in range(num_dealers):
-            self.agents.append(Agent(i + num_citizens, self, "dealer"))
-        
-        # Create police
-        for i in range(num_police):
-            self.agents.append(Agent(i + num_citizens + num_dealers, self, "police"))
-        
-        # Create data collectors
-        for i in range(num_data_collectors):
-            self.agents.append(Agent(i + num_citizens + num_dealers + num_police, self, "data-collector"))
+        counts = {
+            "citizen": num_citizens,
+            "dealer": num_dealers,
+            "police": num_police,
+            "data-collector": num_data_collectors,
+        }
+        self.create_agents(counts)
+        self.stop_reason = self.check_stop()
+
+    @classmethod
+    def from_scenario(cls, scenario):
+        # Build a model from a scenario dict or a path to a JSON/TOML scenario file
+        if isinstance(scenario, str):
+            scenario = load_scenario(scenario)
+        else:
+            scenario = validate_scenario(scenario)
+        agents = scenario["agents"]
+        model = cls(
+            scenario["width"],
+            scenario["height"],
+            agents["citizen"], agents["dealer"], agents["police"], agents["data-collector"],
+            behavior=scenario["behavior"],
+            placement=scenario["placement"],
+            seed=scenario["seed"],
+            radius=scenario["radius"],
+            stop=scenario["stop"],
+        )
+        if scenario.get("shared_memory"):
+            model.share_state(scenario["shared_memory"])
+        return model
+
+    def place_agents(self, role, count):
+        # Draw positions for a whole batch of agents at once
+        spec = self.placement.get(role)
+        if spec is None or spec == "random":
+            xs = self.rng.integers(0, self.grid_width, count)
+            ys = self.rng.integers(0, self.grid_height, count)
+        elif "positions" in spec:
+            positions = np.asarray(spec["positions"], dtype=np.int64).reshape(-1, 2)
+            if len(positions) < count:
+                raise ValueError(f"Scenario lists {len(positions)} positions for {count} {role} agents")
+            xs, ys = positions[:count, 0], positions[:count, 1]
+            if (xs.min(initial=0) < 0 or xs.max(initial=0) >= self.grid_width or
+                    ys.min(initial=0) < 0 or ys.max(initial=0) >= self.grid_height):
+                raise ValueError(f"Scenario places {role} agents outside the grid")
+        elif "density" in spec:
+            # Density map is given as rows (y) of columns (x)
+            weights = np.asarray(spec["density"], dtype=np.float64)
+            if weights.shape != (self.grid_height, self.grid_width):
+                raise ValueError(f"Density map for {role} must be {self.grid_height} rows of {self.grid_width} values")
+            if (weights < 0).any() or weights.sum() <= 0:
+                raise ValueError(f"Density map for {role} needs non-negative weights with a positive sum")
+            cells = self.rng.choice(weights.size, size=count, p=(weights / weights.sum()).ravel())
+            ys, xs = np.divmod(cells, self.grid_width)
+        else:
+            raise ValueError(f"Unknown placement for {role}: {spec}")
+        return xs, ys
+
+    def create_agents(self, counts):
+        with gc_paused():
+            first_id = next_id = len(self.agents)
+            all_xs, all_ys, all_codes = [], [], []
+            for role in AGENT_ROLES:
+                count = counts.get(role, 0)
+                xs, ys = self.place_agents(role, count)
+                if role == "citizen":
+                    trust_levels = self.rng.integers(0, 101, count).tolist()
+                else:
+                    trust_levels = [None] * count
+                self.agents.extend(map(Agent, range(next_id, next_id + count), [self] * count,
+                                       [role] * count, zip(xs.tolist(), ys.tolist()), trust_levels))
+                next_id += count
+                all_xs.append(xs)
+                all_ys.append(ys)
+                all_codes.append(np.full(count, DISPLAY_CODES[role]))
+            self.grid.add_agents(self.agents, np.concatenate(all_xs), np.concatenate(all_ys),
+                                 np.concatenate(all_codes), first=first_id)
     
+    def counters(self):
+        return (self.drug_users, self.drug_dealers, self.arrests)
+
+    def check_stop(self):
+        # Return why the run should end, or None to keep going
+        criteria = self.stop_criteria
+        if criteria["dealers_arrested"] and self.drug_dealers <= 0:
+            return "All drug dealers arrested"
+        if criteria["max_steps"] is not None and self.simulation_time >= criteria["max_steps"]:
+            return "Step limit reached"
+        if criteria["stable_steps"] is not None and self.steps_unchanged >= criteria["stable_steps"]:
+            return f"No change for {self.steps_unchanged} steps"
+        window = criteria["variance_window"]
+        threshold = criteria["variance_threshold"]
+        if window is not None and threshold is not None and len(self.counter_history) >= window:
+            if all(statistics.pvariance(values) <= threshold for values in zip(*self.counter_history)):
+                return "Counters converged"
+        return None
+
     def step(self):
-        if self.drug_dealers > 0:
-            for agent in self.agents:
-                agent.step()
-            self.simulation_time += 1
-        else:
-            print("Simulation completed: All drug dealers arrested")
+        if self.stop_reason is not None:
+            return False
+
+        before = self.counters()
+        for agent in self.agents:
+            agent.step()
+        self.simulation_time += 1
+
+        after = self.counters()
+        self.steps_unchanged = self.steps_unchanged + 1 if after == before else 0
+        self.counter_history.append(after)
+        if self.shared_state is not None:
+            self.shared_state.publish(self)
+
+        self.stop_reason = self.check_stop()
+        if self.stop_reason is not None:
+            print(f"Simulation completed: {self.stop_reason}")
+        return self.stop_reason is None
+
+    def share_state(self, name=None):
+        # Publish agent state to a shared-memory segment after every step and return its name.
+        # Other processes attach with shared_state.SharedStateReader(name).
+        if self.shared_state is None:
+            self.shared_state = SharedStateWriter(len(self.agents), self.grid_width, self.grid_height, name)
+            self.shared_state.publish(self)
+        return self.shared_state.name
+
+    def close_shared_state(self):
+        if self.shared_state is not None:
+            self.shared_state.close()
+            self.shared_state = None
+
+    def run_until(self, **criteria):
+        # Step until a stopping criterion is met and summarise the run.
+        # Keyword arguments override the model's stop criteria for this and later runs.
+        merged = {**self.stop_criteria, **criteria}
+        validate_stop(merged)
+        if merged["max_steps"] is None and merged["stable_steps"] is None and merged["variance_window"] is None:
+            # Dealers may never all be caught, so that criterion alone can loop forever
+            raise ValueError("run_until needs max_steps, stable_steps or a variance window to bound the run")
+        self.stop_criteria = merged
+        window = self.stop_criteria["variance_window"] or 0
+        if self.counter_history.maxlen != window:
+            self.counter_history = deque(self.counter_history, maxlen=window)
+
+        start_time = time.perf_counter()
+        start_step = self.simulation_time
+        self.stop_reason = self.check_stop()
+        while self.step():
+            pass
+
+        return {
+            "stop_reason": self.stop_reason,
+            "steps": self.simulation_time,
+            "steps_this_run": self.simulation_time - start_step,
+            "elapsed_seconds": time.perf_counter() - start_time,
+            "drug_users": self.drug_users,
+            "drug_dealers": self.drug_dealers,
+            "arrests": self.arrests,
+        }
+
+def draw_fast_view(screen, model, area, surface=None):
+    # Draw the per-cell dominant role with one surfarray write and one scaled blit.
+    # Returns the one-pixel-per-cell surface so the caller can reuse it next frame.
+    grid_size = (model.grid_width, model.grid_height)
+    if surface is None or surface.get_size() != grid_size:
+        surface = pygame.Surface(grid_size)
+    pygame.surfarray.blit_array(surface, model.grid.dominant_colours())
+    scale = min(area.width / model.grid_width, area.height / model.grid_height)
+    size = (max(1, int(model.grid_width * scale)), max(1, int(model.grid_height * scale)))
+    pygame.transform.scale(surface, size, screen.subsurface(pygame.Rect(area.topleft, size)))
+    return surface
 
 def main():
     pygame.init()
@@ -212,12 +676,13 @@ def main():
     label_font = pygame.font.Font(None, 23)
     message_font = pygame.font.Font(None, 18)
 
-    # Simulation parameters
-    num_citizens = 200
-    num_dealers = 10
-    num_police = 10
-    num_data_collectors = 5
-    model = DrugModel(40, 35, num_citizens, num_dealers, num_police, num_data_collectors)
+    # Simulation parameters, optionally read from a scenario file given on the command line
+    scenario = load_scenario(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SCENARIO
+    num_citizens = scenario["agents"]["citizen"]
+    num_dealers = scenario["agents"]["dealer"]
+    num_police = scenario["agents"]["police"]
+    num_data_collectors = scenario["agents"]["data-collector"]
+    model = DrugModel.from_scenario(scenario)
 
     # Buttons and Sliders
     setup_button = pygame_gui.elements.UIButton(
@@ -231,32 +696,45 @@ def main():
         text='Pause/Resume',
         manager=manager
     )
-    # Agent count sliders
+
+    # Large grids do not fit the detailed view, so they start in the fast view
+    grid_area = pygame.Rect(0, 0, WINDOW_WIDTH - SIDEBAR_WIDTH, WINDOW_HEIGHT)
+    fast_view = (model.grid_width * GRID_SIZE > grid_area.width or
+                 model.grid_height * GRID_SIZE > grid_area.height)
+    fast_view_surface = None
+    view_button = pygame_gui.elements.UIButton(
+        relative_rect=pygame.Rect((WINDOW_WIDTH - SIDEBAR_WIDTH + 185, 60), (105, 40)),
+        text='Detailed View' if fast_view else 'Fast View',
+        manager=manager
+    )
+    # Agent count sliders, widened to fit the scenario's counts
     citizen_slider = pygame_gui.elements.UIHorizontalSlider(
         relative_rect=pygame.Rect((WINDOW_WIDTH - SIDEBAR_WIDTH + 40, 170), (200, 20)),
         start_value=num_citizens,
-        value_range=(50, 500),
+        value_range=(min(50, num_citizens), max(500, num_citizens)),
         manager=manager
     )
     dealer_slider = pygame_gui.elements.UIHorizontalSlider(
         relative_rect=pygame.Rect((WINDOW_WIDTH - SIDEBAR_WIDTH + 40, 220), (200, 20)),
         start_value=num_dealers,
-        value_range=(5, 50),
+        value_range=(min(5, num_dealers), max(50, num_dealers)),
         manager=manager
     )
     police_slider = pygame_gui.elements.UIHorizontalSlider(
         relative_rect=pygame.Rect((WINDOW_WIDTH - SIDEBAR_WIDTH + 40, 270), (200, 20)),
         start_value=num_police,
-        value_range=(5, 50),
+        value_range=(min(5, num_police), max(50, num_police)),
         manager=manager
     )
     data_collector_slider = pygame_gui.elements.UIHorizontalSlider(
         relative_rect=pygame.Rect((WINDOW_WIDTH - SIDEBAR_WIDTH + 40, 320), (200, 20)),
         start_value=num_data_collectors,
-        value_range=(1, 20),
+        value_range=(min(1, num_data_collectors), max(20, num_data_collectors)),
         manager=manager
     )
 
+    reset_error = None
+
     # Simulation labels
     clock = pygame.time.Clock()
     running = True
@@ -278,9 +756,34 @@ def main():
                     num_dealers = int(dealer_slider.get_current_value())
                     num_police = int(police_slider.get_current_value())
                     num_data_collectors = int(data_collector_slider.get_current_value())
-                    model = DrugModel(40, 35, num_citizens, num_dealers, num_police, num_data_collectors)
+                    counts = {
+                        "citizen": num_citizens,
+                        "dealer": num_dealers,
+                        "police": num_police,
+                        "data-collector": num_data_collectors,
+                    }
+                    # Roles with more agents than listed positions fall back to random placement
+                    placement = {
+                        role: spec for role, spec in scenario["placement"].items()
+                        if not (isinstance(spec, dict) and "positions" in spec
+                                and len(spec["positions"]) < counts[role])
+                    }
+                    model.close_shared_state()
+                    try:
+                        new_model = DrugModel.from_scenario({**scenario, "agents": counts, "placement": placement})
+                    except ValueError as e:
+                        reset_error = f"Reset failed: {e}"
+                        if scenario["shared_memory"]:
+                            model.share_state(scenario["shared_memory"])
+                    else:
+                        reset_error = None
+                        gc.unfreeze()  # let the old model's agents be collected, see gc_paused
+                        model = new_model
                 elif event.ui_element == pause_button:
                     paused = not paused
+                elif event.ui_element == view_button:
+                    fast_view = not fast_view
+                    view_button.set_text('Detailed View' if fast_view else 'Fast View')
 
         manager.update(delta_time)
 
@@ -293,12 +796,15 @@ def main():
         screen.fill((240, 240, 240))  # Light gray background
 
         # Draw simulation grid
-        for agent in model.agents:
-            x, y = agent.pos
-            icon = agent.icon
-            rect = pygame.Rect(x * GRID_SIZE, y * GRID_SIZE, GRID_SIZE, GRID_SIZE)
-            screen.blit(icon, rect.topleft)
-            pygame.draw.rect(screen, (200, 200, 200), rect, 1)  
+        if fast_view:
+            fast_view_surface = draw_fast_view(screen, model, grid_area, fast_view_surface)
+        else:
+            for agent in model.agents:
+                x, y = agent.pos
+                icon = agent.icon
+                rect = pygame.Rect(x * GRID_SIZE, y * GRID_SIZE, GRID_SIZE, GRID_SIZE)
+                screen.blit(icon, rect.topleft)
+                pygame.draw.rect(screen, (200, 200, 200), rect, 1)  
 
         # Sidebar background
         sidebar_rect = pygame.Rect(WINDOW_WIDTH - SIDEBAR_WIDTH, 0, SIDEBAR_WIDTH, WINDOW_HEIGHT)
@@ -312,18 +818,29 @@ def main():
         time_text = label_font.render(f"Simulation Time: {model.simulation_time}", True, (0, 0, 0))
 
         screen.blit(title, (WINDOW_WIDTH - SIDEBAR_WIDTH + 40, 15))
+        if reset_error:
+            error_text = message_font.render(reset_error, True, (180, 0, 0))
+            screen.blit(error_text, (WINDOW_WIDTH - SIDEBAR_WIDTH + 10, 42))
         screen.blit(drug_users_text, (WINDOW_WIDTH - SIDEBAR_WIDTH + 50, 350))
         screen.blit(drug_dealers_text, (WINDOW_WIDTH - SIDEBAR_WIDTH + 50, 370))
         screen.blit(arrests_text, (WINDOW_WIDTH - SIDEBAR_WIDTH + 50, 390))
         screen.blit(time_text, (WINDOW_WIDTH - SIDEBAR_WIDTH + 50, 410))
 
-        # Agent images
-        screen.blit(model.citizen_icon, (WINDOW_WIDTH - SIDEBAR_WIDTH + 25, 435))
-        screen.blit(model.data_collector_icon, (WINDOW_WIDTH - SIDEBAR_WIDTH + 25, 458))
-        screen.blit(model.police_icon, (WINDOW_WIDTH - SIDEBAR_WIDTH + 25, 481))
-        screen.blit(model.dealer_icon, (WINDOW_WIDTH - SIDEBAR_WIDTH + 25, 504))
-        screen.blit(model.drug_user_icon, (WINDOW_WIDTH - SIDEBAR_WIDTH + 25, 527))
-        screen.blit(model.arrest_icon, (WINDOW_WIDTH - SIDEBAR_WIDTH + 25, 550))
+        # Agent images, or the matching colours in the fast view
+        legend = [
+            (model.citizen_icon, DISPLAY_CODES["citizen"], 435),
+            (model.data_collector_icon, DISPLAY_CODES["data-collector"], 458),
+            (model.police_icon, DISPLAY_CODES["police"], 481),
+            (model.dealer_icon, DISPLAY_CODES["dealer"], 504),
+            (model.drug_user_icon, DISPLAY_CODES["drug-user"], 527),
+            (model.arrest_icon, ARRESTED_CODE, 550),
+        ]
+        for icon, code, y in legend:
+            if fast_view:
+                swatch = pygame.Rect(WINDOW_WIDTH - SIDEBAR_WIDTH + 25, y, 20, 20)
+                pygame.draw.rect(screen, DISPLAY_COLOURS[code].tolist(), swatch)
+            else:
+                screen.blit(icon, (WINDOW_WIDTH - SIDEBAR_WIDTH + 25, y))
         
         # Icon labels
         citizen_label = label_font.render("Citizen", True, (0, 0, 0))
@@ -363,6 +880,7 @@ def main():
         
         pygame.display.update()
 
+    model.close_shared_state()
     pygame.quit()
 
 
@@ -0,0 +1,185 @@
+import struct
+import sys
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+# Fixed layout of the shared-memory segment (all little-endian):
+#
+#   segment header                     HEADER, padded to HEADER_SIZE
+#   slot 0, slot 1                     two copies of the model state
+#
+# and each slot is
+#
+#   slot header                        SLOT_HEADER, padded to SLOT_HEADER_SIZE
+#   x, y          int32[num_agents]    agent positions
+#   role          uint8[num_agents]    index into ROLES
+#   status        uint8[num_agents]    1 = active, 0 = arrested
+#   trust_level   int16[num_agents]    -1 for agents without one
+#   drug_presence int64[height, width]
+#
+# The writer fills the slot that is not the latest one, so readers always
+# have a whole step to look at the latest slot. A slot's sequence number is
+# odd while it is being written. A reader checks that the number is
+# unchanged after reading to know the data is consistent.
+
+MAGIC = b"DRUGSHM1"
+VERSION = 1
+ROLES = ("citizen", "dealer", "police", "data-collector", "drug-user")
+ROLE_CODES = {role: code for code, role in enumerate(ROLES)}
+
+# magic, version, num_agents, width, height, slot size, snapshots published
+HEADER = struct.Struct("<8sIIIIqq")
+HEADER_SIZE = 64
+PUBLISHED_OFFSET = 32
+# sequence, simulation time, drug users, drug dealers, arrests
+SLOT_HEADER = struct.Struct("<qqqqq")
+SLOT_HEADER_SIZE = 64
+
+# Segments created by writers in this process; the resource tracker registration for
+# these belongs to the writer, so readers in the same process must leave it alone
+_created_here = set()
+
+def _align(size):
+    return (size + 7) // 8 * 8
+
+def _slot_layout(num_agents, width, height):
+    # (name, dtype, shape, offset from the start of the slot) for every array, and the slot size
+    fields = [
+        ("x", np.int32, (num_agents,)),
+        ("y", np.int32, (num_agents,)),
+        ("role", np.uint8, (num_agents,)),
+        ("status", np.uint8, (num_agents,)),
+        ("trust_level", np.int16, (num_agents,)),
+        ("drug_presence", np.int64, (height, width)),
+    ]
+    layout = []
+    offset = SLOT_HEADER_SIZE
+    for name, dtype, shape in fields:
+        layout.append((name, dtype, shape, offset))
+        offset += _align(int(np.prod(shape)) * np.dtype(dtype).itemsize)
+    return layout, offset
+
+class _Slot:
+    # Numpy views onto one slot of the segment
+    def __init__(self, buffer, offset, layout):
+        self.header = np.ndarray((SLOT_HEADER.size // 8,), dtype=np.int64, buffer=buffer, offset=offset)
+        self.arrays = {
+            name: np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset + field_offset)
+            for name, dtype, shape, field_offset in layout
+        }
+
+class SharedStateWriter:
+    # Owns the segment and publishes a snapshot of a DrugModel into it
+    def __init__(self, num_agents, width, height, name=None):
+        layout, self.slot_size = _slot_layout(num_agents, width, height)
+        self.num_agents = num_agents
+        self.width = width
+        self.height = height
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=HEADER_SIZE + 2 * self.slot_size)
+        self.name = self.shm.name
+        _created_here.add(self.name)
+
+        HEADER.pack_into(self.shm.buf, 0, MAGIC, VERSION, num_agents, width, height, self.slot_size, 0)
+        self.published = np.ndarray((1,), dtype=np.int64, buffer=self.shm.buf, offset=PUBLISHED_OFFSET)
+        self.slots = [_Slot(self.shm.buf, HEADER_SIZE + i * self.slot_size, layout) for i in range(2)]
+
+    def publish(self, model):
+        if len(model.agents) != self.num_agents:
+            raise ValueError(f"Segment holds {self.num_agents} agents but the model has {len(model.agents)}")
+
+        slot = self.slots[int(self.published[0]) % 2]
+        slot.header[0] += 1  # odd: slot is being written
+
+        agents = model.agents
+        count = self.num_agents
+        arrays = slot.arrays
+        arrays["x"][:] = np.fromiter((agent.pos[0] for agent in agents), np.int32, count)
+        arrays["y"][:] = np.fromiter((agent.pos[1] for agent in agents), np.int32, count)
+        arrays["role"][:] = np.fromiter((ROLE_CODES[agent.role] for agent in agents), np.uint8, count)
+        arrays["status"][:] = np.fromiter((agent.status == "active" for agent in agents), np.uint8, count)
+        arrays["trust_level"][:] = np.fromiter(
+            (getattr(agent, "trust_level", -1) for agent in agents), np.int16, count)
+
+        arrays["drug_presence"][:] = model.drug_presence
+
+        slot.header[1:] = (model.simulation_time, model.drug_users, model.drug_dealers, model.arrests)
+        slot.header[0] += 1  # even: slot is consistent again
+        self.published[0] += 1
+
+    def close(self):
+        # Detach and remove the segment; attached readers keep their mapping until they close
+        self.published = None
+        self.slots = []
+        self.shm.close()
+        self.shm.unlink()
+        _created_here.discard(self.name)
+
+class SharedStateReader:
+    # Read-only view of a segment published by SharedStateWriter, for use from another process
+    def __init__(self, name):
+        if sys.version_info >= (3, 13):
+            self.shm = shared_memory.SharedMemory(name=name, track=False)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            if self.shm.name not in _created_here:
+                # Only the writer may unlink the segment when this process exits
+                resource_tracker.unregister(self.shm._name, "shared_memory")
+
+        magic, version, num_agents, width, height, slot_size, _ = HEADER.unpack_from(self.shm.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            self.shm.close()
+            raise ValueError(f"{name} is not a drug model state segment")
+        self.num_agents = num_agents
+        self.width = width
+        self.height = height
+
+        layout, _ = _slot_layout(num_agents, width, height)
+        # Every array on the segment keeps a reference to the mapping; close() uses this
+        # count to tell whether any are still alive
+        self._mapping_refs = sys.getrefcount(self.shm._mmap)
+        self.published = np.ndarray((1,), dtype=np.int64, buffer=self.shm.buf, offset=PUBLISHED_OFFSET)
+        self.slots = [_Slot(self.shm.buf, HEADER_SIZE + i * slot_size, layout) for i in range(2)]
+        self.published.flags.writeable = False
+        for slot in self.slots:
+            slot.header.flags.writeable = False
+            for array in slot.arrays.values():
+                array.flags.writeable = False
+
+    def snapshot(self, copy=True, retries=1000):
+        # Latest consistent state as a dict of arrays plus the step counters.
+        # With copy=False the arrays are zero-copy views; check still_valid(snapshot)
+        # after using them, since the writer reuses the slot two steps later. Zero-copy
+        # snapshots keep the mapping in use, so drop them before calling close().
+        for _ in range(retries):
+            published = int(self.published[0])
+            if published == 0:
+                return None
+            slot = self.slots[(published - 1) % 2]
+            sequence = int(slot.header[0])
+            if sequence % 2:
+                continue
+            header = slot.header.tolist()
+            arrays = {name: array.copy() if copy else array for name, array in slot.arrays.items()}
+            if int(slot.header[0]) != sequence:
+                continue
+            state = dict(zip(("simulation_time", "drug_users", "drug_dealers", "arrests"), header[1:]))
+            state.update(arrays)
+            state["sequence"] = (published - 1, sequence)
+            return state
+        raise TimeoutError("Could not read a consistent snapshot; the writer is publishing too fast")
+
+    def still_valid(self, snapshot):
+        # True while a zero-copy snapshot has not been overwritten by the writer
+        published, sequence = snapshot["sequence"]
+        return int(self.slots[published % 2].header[0]) == sequence
+
+    def close(self):
+        # Refuses to unmap the segment while any snapshot(copy=False) array, or a view of
+        # one, is still referenced, since reading it afterwards would crash the process.
+        # Delete those first and call close() again.
+        self.published = None
+        self.slots = []
+        if sys.getrefcount(self.shm._mmap) > self._mapping_refs:
+            raise BufferError("Zero-copy snapshots are still in use; delete them before closing the reader")
+        self.shm.close()
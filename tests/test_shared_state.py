@@ -0,0 +1,138 @@
+import multiprocessing
+import os
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared_state import SharedStateReader, SharedStateWriter
+
+NUM_AGENTS = 500
+WIDTH, HEIGHT = 30, 20
+
+def make_model():
+    agents = [SimpleNamespace(pos=(0, 0), role="citizen", status="active", trust_level=0)
+              for _ in range(NUM_AGENTS)]
+    return SimpleNamespace(agents=agents, drug_presence=np.zeros((HEIGHT, WIDTH), dtype=np.int64),
+                           simulation_time=0, drug_users=0, drug_dealers=0, arrests=0)
+
+def advance(model):
+    # Every published value is derived from the step, so a torn snapshot shows up as a mismatch
+    step = model.simulation_time + 1
+    model.simulation_time = step
+    model.drug_users = model.drug_dealers = model.arrests = step
+    for agent in model.agents:
+        agent.pos = (step % WIDTH, step % HEIGHT)
+        agent.trust_level = step % 100
+    model.drug_presence.fill(step)
+
+def run_writer(conn, steps):
+    model = make_model()
+    writer = SharedStateWriter(NUM_AGENTS, WIDTH, HEIGHT)
+    writer.publish(model)
+    conn.send(writer.name)
+    if steps is None:
+        # Publish one step per request so the parent controls the timing
+        while conn.recv() == "publish":
+            advance(model)
+            writer.publish(model)
+            conn.send("published")
+    else:
+        conn.recv()
+        for _ in range(steps):
+            advance(model)
+            writer.publish(model)
+        conn.send("done")
+        conn.recv()
+    writer.close()
+
+def start_writer(steps):
+    context = multiprocessing.get_context("spawn")
+    parent, child = context.Pipe()
+    process = context.Process(target=run_writer, args=(child, steps))
+    process.start()
+    return process, parent, parent.recv()
+
+def check_consistent(snapshot):
+    step = snapshot["simulation_time"]
+    assert snapshot["x"].shape == snapshot["y"].shape == (NUM_AGENTS,)
+    assert snapshot["drug_presence"].shape == (HEIGHT, WIDTH)
+    assert snapshot["drug_users"] == snapshot["drug_dealers"] == snapshot["arrests"] == step
+    assert (snapshot["x"] == step % WIDTH).all()
+    assert (snapshot["y"] == step % HEIGHT).all()
+    assert (snapshot["trust_level"] == step % 100).all()
+    assert (snapshot["drug_presence"] == step).all()
+
+def test_snapshots_are_consistent_while_writer_runs():
+    process, conn, name = start_writer(steps=300)
+    reader = SharedStateReader(name)
+    try:
+        conn.send("go")
+        seen = set()
+        while not conn.poll():
+            snapshot = reader.snapshot()
+            check_consistent(snapshot)
+            seen.add(snapshot["simulation_time"])
+        assert conn.recv() == "done"
+        final = reader.snapshot()
+        check_consistent(final)
+        assert final["simulation_time"] == 300
+        assert len(seen) > 1
+    finally:
+        reader.close()
+        conn.send("exit")
+        process.join(10)
+    assert process.exitcode == 0
+
+def test_zero_copy_snapshot_expires_after_two_publishes():
+    process, conn, name = start_writer(steps=None)
+    reader = SharedStateReader(name)
+    try:
+        snapshot = reader.snapshot(copy=False)
+        check_consistent(snapshot)
+        assert reader.still_valid(snapshot)
+
+        conn.send("publish")
+        assert conn.recv() == "published"
+        assert reader.still_valid(snapshot)
+        check_consistent(snapshot)
+
+        conn.send("publish")
+        assert conn.recv() == "published"
+        assert not reader.still_valid(snapshot)
+        del snapshot
+    finally:
+        reader.close()
+        conn.send("exit")
+        process.join(10)
+    assert process.exitcode == 0
+
+def test_close_explains_live_zero_copy_snapshots():
+    writer = SharedStateWriter(NUM_AGENTS, WIDTH, HEIGHT)
+    reader = SharedStateReader(writer.name)
+    try:
+        writer.publish(make_model())
+        snapshot = reader.snapshot(copy=False)
+        with pytest.raises(BufferError, match="delete them"):
+            reader.close()
+        del snapshot
+        reader.close()
+    finally:
+        writer.close()
+
+def test_close_waits_for_views_of_zero_copy_snapshots():
+    writer = SharedStateWriter(NUM_AGENTS, WIDTH, HEIGHT)
+    reader = SharedStateReader(writer.name)
+    try:
+        writer.publish(make_model())
+        first_agents = reader.snapshot(copy=False)["x"][:10]
+        with pytest.raises(BufferError):
+            reader.close()
+        assert (first_agents == 0).all()
+        del first_agents
+        reader.close()
+    finally:
+        writer.close()
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from main import DrugModel, SpatialGrid, display_code
+
+def test_neighbourhood_is_clipped_square():
+    grid = SpatialGrid(7, 5)
+    for radius in range(4):
+        for x in range(7):
+            for y in range(5):
+                expected = [ny * 7 + nx
+                            for nx in range(max(0, x - radius), min(7, x + radius + 1))
+                            for ny in range(max(0, y - radius), min(5, y + radius + 1))]
+                assert list(grid.neighbourhood((x, y), radius)) == expected
+
+def test_grid_matches_recount_after_steps():
+    model = DrugModel(30, 25, 600, 15, 15, 5, seed=7,
+                      radius={"citizen": 1, "dealer": 2, "police": 2, "data-collector": 2})
+    model.create_agents({"citizen": 100, "police": 5})
+    for _ in range(40):
+        model.step()
+
+    grid = model.grid
+    expected_counts = np.zeros_like(grid.display_counts)
+    expected_cells = [[] for _ in range(len(grid.cells))]
+    for agent in model.agents:
+        x, y = agent.pos
+        assert 0 <= x < model.grid_width and 0 <= y < model.grid_height
+        index = grid.cell_index(agent.pos)
+        expected_counts[display_code(agent), index] += 1
+        expected_cells[index].append(agent.unique_id)
+
+    assert (grid.display_counts == expected_counts).all()
+    for index, expected in enumerate(expected_cells):
+        assert sorted(agent.unique_id for agent in grid.cell(index)) == expected
+
+@pytest.mark.parametrize("kwargs", [
+    {"radius": {"dealer": -1}},
+    {"radius": {"police": True}},
+    {"radius": {"police": None}},
+    {"behavior": {"dealer_seek_chance": 1.5}},
+    {"behavior": {"arrest_chance": "high"}},
+    {"placement": {"dealer": "cluster"}},
+])
+def test_constructor_rejects_bad_settings(kwargs):
+    with pytest.raises(ValueError):
+        DrugModel(10, 10, 5, 3, 0, 0, **kwargs)
@@ -0,0 +1,74 @@
+import pytest
+
+from main import DrugModel, validate_stop
+
+@pytest.mark.parametrize("criteria", [
+    {"variance_window": 0, "variance_threshold": 1},
+    {"variance_window": 5},
+    {"variance_threshold": 1},
+    {"variance_window": 5, "variance_threshold": -0.5},
+    {"max_steps": -1},
+    {"stable_steps": True},
+    {"dealers_arrested": "yes"},
+    {"max_step": 10},
+])
+def test_validate_stop_rejects(criteria):
+    with pytest.raises(ValueError):
+        validate_stop(criteria)
+
+def test_validate_stop_accepts_zero_threshold():
+    validate_stop({"variance_window": 5, "variance_threshold": 0, "max_steps": 0, "stable_steps": 0})
+
+def test_check_stop_reasons():
+    model = DrugModel(10, 10, 20, 3, 0, 1, seed=1)
+    assert model.check_stop() is None
+
+    model.stop_criteria["max_steps"] = 4
+    model.simulation_time = 4
+    assert model.check_stop() == "Step limit reached"
+    model.stop_criteria["max_steps"] = None
+
+    model.stop_criteria["stable_steps"] = 3
+    model.steps_unchanged = 3
+    assert model.check_stop() == "No change for 3 steps"
+    model.stop_criteria["stable_steps"] = None
+
+    model.drug_dealers = 0
+    assert model.check_stop() == "All drug dealers arrested"
+
+def test_check_stop_variance_needs_full_window():
+    model = DrugModel(10, 10, 20, 3, 0, 1, seed=1, stop={"variance_window": 3, "variance_threshold": 0})
+    model.counter_history.extend([(1, 3, 0), (1, 3, 0)])
+    assert model.check_stop() is None
+    model.counter_history.append((1, 3, 0))
+    assert model.check_stop() == "Counters converged"
+    model.counter_history.append((2, 3, 0))
+    assert model.check_stop() is None
+
+def test_model_without_dealers_is_finished_at_start():
+    model = DrugModel(10, 10, 20, 0, 1, 1)
+    assert model.stop_reason == "All drug dealers arrested"
+    assert model.step() is False
+    assert model.simulation_time == 0
+
+def test_run_until_refuses_unbounded_run():
+    model = DrugModel(10, 10, 20, 3, 0, 1, seed=1)
+    with pytest.raises(ValueError):
+        model.run_until()
+    assert model.stop_criteria["max_steps"] is None
+
+def test_run_until_step_limit():
+    model = DrugModel(10, 10, 20, 3, 0, 1, seed=1)
+    summary = model.run_until(max_steps=25)
+    assert summary["stop_reason"] == "Step limit reached"
+    assert summary["steps"] == summary["steps_this_run"] == 25
+    assert (summary["drug_users"], summary["drug_dealers"], summary["arrests"]) == model.counters()
+
+    summary = model.run_until(max_steps=40)
+    assert summary["steps"] == 40 and summary["steps_this_run"] == 15
+
+def test_run_until_zero_variance_threshold_converges():
+    # No police, so dealers are never caught; the counters settle once citizens stop converting
+    model = DrugModel(10, 10, 20, 3, 0, 1, seed=1)
+    summary = model.run_until(variance_window=5, variance_threshold=0, max_steps=20000)
+    assert summary["stop_reason"] == "Counters converged"